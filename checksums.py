@@ -0,0 +1,125 @@
+# checksums Copyright (c) 2026 Stuart Pook (http://www.pook.it/)
+# Checksums of files that are only computed again when the files change
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import errno
+import hashlib
+import sqlite3
+import threading
+import concurrent.futures
+
+BLOCK = 1 << 20
+
+# the file system cannot keep this extended attribute on this file
+NO_XATTR = frozenset([errno.ENOTSUP, errno.EOPNOTSUPP, errno.EROFS, errno.EACCES, errno.EPERM, errno.ENOSPC, errno.E2BIG])
+
+def file_digest(f, algorithm="md5"):
+    '''the hex digest of the open binary file f'''
+    h = hashlib.new(algorithm)
+    while True:
+        block = f.read(BLOCK)
+        if not block:
+            break
+        h.update(block)
+    return h.hexdigest()
+
+def default_database():
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "checksums.sqlite")
+
+def key(st):
+    return "%d %d %d" % (st.st_size, st.st_mtime_ns, st.st_ino)
+
+class Checksums:
+    '''
+    Digests of files, stored with the size, mtime_ns and inode of the file
+    they were computed from and used again while those are unchanged.  They
+    are kept in the user.checksum.ALGORITHM extended attribute of the file
+    (which changes its ctime) when xattrs is true and the file system allows
+    it, otherwise in the sqlite database (None for none).  The files that
+    must be read are read by a pool of threads.
+    '''
+    def __init__(self, database=None, algorithm="md5", threads=4, xattrs=True):
+        self.algorithm = algorithm
+        self.attribute = "user.checksum." + algorithm
+        self.xattrs = xattrs
+        self.threads = threads
+        self.lock = threading.Lock()
+        self.db = None
+        if database:
+            try:
+                os.makedirs(os.path.dirname(database), exist_ok=True)
+                self.db = sqlite3.connect(database, timeout=60, check_same_thread=False, isolation_level=None)
+                self.db.execute("PRAGMA journal_mode=WAL")
+                self.db.execute("CREATE TABLE IF NOT EXISTS checksums (dev INTEGER, ino INTEGER, algorithm TEXT, key TEXT, digest TEXT, PRIMARY KEY (dev, ino, algorithm))")
+            except (OSError, sqlite3.Error):
+                self.db = None
+
+    def cached(self, path, st):
+        if self.xattrs:
+            try:
+                k, digest = os.getxattr(path, self.attribute).decode('ascii').rsplit(" ", 1)
+                if k == key(st):
+                    return digest
+            except OSError as ex:
+                if ex.errno not in NO_XATTR and ex.errno != errno.ENODATA:
+                    raise
+            except ValueError:
+                pass
+        if self.db is not None:
+            with self.lock:
+                row = self.db.execute("SELECT key, digest FROM checksums WHERE dev = ? AND ino = ? AND algorithm = ?", (st.st_dev, st.st_ino, self.algorithm)).fetchone()
+            if row and row[0] == key(st):
+                return row[1]
+        return None
+
+    def store(self, path, st, digest):
+        if self.xattrs:
+            try:
+                os.setxattr(path, self.attribute, (key(st) + " " + digest).encode('ascii'))
+                return
+            except OSError as ex:
+                if ex.errno not in NO_XATTR:
+                    raise
+        if self.db is not None:
+            with self.lock:
+                self.db.execute("INSERT OR REPLACE INTO checksums VALUES (?, ?, ?, ?, ?)", (st.st_dev, st.st_ino, self.algorithm, key(st), digest))
+
+    def digest(self, path):
+        '''the hex digest of the file path'''
+        st = os.stat(path)
+        digest = self.cached(path, st)
+        if digest is not None:
+            return digest
+        with open(path, "rb") as f:
+            digest = file_digest(f, self.algorithm)
+            after = os.fstat(f.fileno())
+        if key(after) == key(st): # not changed while being read
+            self.store(path, st, digest)
+        return digest
+
+    def map(self, paths):
+        '''the hex digests of paths, in the same order'''
+        with concurrent.futures.ThreadPoolExecutor(self.threads) as pool:
+            yield from pool.map(self.digest, paths)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,244 @@
+# exif_header Copyright (c) 2026 Stuart Pook (http://www.pook.it/)
+# Read the few EXIF tags that the photo scripts need and remember them
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import errno
+import stat
+import struct
+import zlib
+import json
+import sqlite3
+import threading
+
+# the tags that are read, named as exifread names them
+IFD0_TAGS = {
+    0x010f: "Image Make",
+    0x0110: "Image Model",
+    0x0111: "Image StripOffsets",
+    0x0112: "Image Orientation",
+    0x0117: "Image StripByteCounts",
+    0x0132: "Image DateTime",
+}
+EXIF_TAGS = {
+    0x829d: "EXIF FNumber",
+    0x9003: "EXIF DateTimeOriginal",
+    0x9004: "EXIF DateTimeDigitized",
+    0x9202: "EXIF ApertureValue",
+    0x9206: "EXIF SubjectDistance",
+    0x920a: "EXIF FocalLength",
+    0xa405: "EXIF FocalLengthIn35mmFilm",
+    0xa433: "EXIF LensMake",
+    0xa434: "EXIF LensModel",
+}
+NAMES = frozenset(IFD0_TAGS.values()) | frozenset(EXIF_TAGS.values())
+EXIF_IFD = 0x8769
+
+HEAD = 64 << 10 # enough for the EXIF of almost every JPEG, TIFF and raw file
+MAX_ENTRIES = 1000
+MAX_VALUE = 4096
+MAX_CHUNKS = 64
+
+# TIFF type: (struct format, size)
+TYPES = { 1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("I", 4), 5: ("II", 8), 7: ("B", 1), 9: ("i", 4), 10: ("ii", 8) }
+
+class Reader:
+    '''bounded reads of a file, the start of which is read once'''
+    def __init__(self, f):
+        self.f = f
+        self.head = f.read(HEAD)
+
+    def read(self, offset, length):
+        if offset < 0 or length < 0:
+            raise ValueError("bad offset %d or length %d" % (offset, length))
+        if offset + length <= len(self.head):
+            return self.head[offset:offset + length]
+        self.f.seek(offset)
+        data = self.f.read(length)
+        if len(data) != length:
+            raise ValueError("short read at %d" % offset)
+        return data
+
+class Buffer:
+    '''a TIFF structure held in memory, for JPEG and PNG'''
+    def __init__(self, data):
+        self.data = data
+
+    def read(self, offset, length):
+        if offset < 0 or length < 0 or offset + length > len(self.data):
+            raise ValueError("bad offset %d or length %d" % (offset, length))
+        return self.data[offset:offset + length]
+
+def value(reader, order, typ, count, field, base):
+    fmt, size = TYPES[typ]
+    length = size * count
+    if length > MAX_VALUE:
+        return None
+    data = field[:length] if length <= 4 else reader.read(base + struct.unpack(order + "I", field)[0], length)
+    if typ == 2:
+        return data.split(b"\0", 1)[0].decode("utf-8", "replace").strip()
+    values = struct.unpack(order + fmt * count, data)
+    if typ in (5, 10):
+        values = tuple(n / d if d else None for n, d in zip(values[0::2], values[1::2]))
+    if typ == 7:
+        return bytes(values).hex()
+    return values[0] if count == 1 else list(values)
+
+def ifd(reader, order, offset, base, names, result):
+    '''the tags in names of the IFD at offset, returns the offset of the Exif IFD if there is one'''
+    n = struct.unpack(order + "H", reader.read(base + offset, 2))[0]
+    entries = reader.read(base + offset + 2, 12 * min(n, MAX_ENTRIES))
+    exif = None
+    for i in range(0, len(entries), 12):
+        tag, typ, count = struct.unpack(order + "HHI", entries[i:i + 8])
+        field = entries[i + 8:i + 12]
+        if tag == EXIF_IFD and typ in (4, 13):
+            exif = struct.unpack(order + "I", field)[0]
+        elif tag in names and typ in TYPES:
+            v = value(reader, order, typ, count, field, base)
+            if v is not None:
+                result[names[tag]] = v
+    return exif
+
+def tiff(reader, base=0):
+    '''the tags of the TIFF structure at base'''
+    header = reader.read(base, 8)
+    order = { b"II": "<", b"MM": ">" }.get(header[:2])
+    if order is None:
+        return {}
+    result = {}
+    exif = ifd(reader, order, struct.unpack(order + "I", header[4:8])[0], base, IFD0_TAGS, result)
+    if exif:
+        ifd(reader, order, exif, base, EXIF_TAGS, result)
+    return result
+
+def jpeg(reader):
+    '''the APP1 Exif segment of a JPEG, stopping at the image data'''
+    offset = 2
+    while True:
+        marker, length = struct.unpack(">HH", reader.read(offset, 4))
+        if marker in (0xffda, 0xffd9) or marker >> 8 != 0xff:
+            return {}
+        if marker == 0xffe1:
+            segment = reader.read(offset + 4, length - 2)
+            if segment.startswith(b"Exif\0\0"):
+                return tiff(Buffer(segment[6:]))
+        offset += 2 + length
+
+def raw_profile(text):
+    '''the TIFF in an ImageMagick "Raw profile type exif" text chunk'''
+    lines = text.split(b"\n", 3)
+    data = bytes.fromhex(lines[3].decode("ascii").replace("\n", ""))
+    return data[6:] if data.startswith(b"Exif\0\0") else data
+
+def png(reader):
+    '''the eXIf chunk of a PNG, or the EXIF that ImageMagick writes in a text chunk'''
+    offset = 8
+    for i in range(MAX_CHUNKS):
+        length, kind = struct.unpack(">I4s", reader.read(offset, 8))
+        if kind in (b"IDAT", b"IEND"):
+            return {}
+        if kind == b"eXIf":
+            return tiff(Buffer(reader.read(offset + 8, length)))
+        if kind in (b"tEXt", b"zTXt") and length < 1 << 20:
+            keyword, text = reader.read(offset + 8, length).split(b"\0", 1)
+            if keyword == b"Raw profile type exif":
+                return tiff(Buffer(raw_profile(zlib.decompress(text[1:]) if kind == b"zTXt" else text)))
+        offset += 12 + length
+    return {}
+
+def read_file(f):
+    '''the tags of the open file f, {} if it is not a JPEG, TIFF (including CR2, NEF and DNG) or PNG or has no EXIF'''
+    reader = Reader(f)
+    try:
+        if reader.head.startswith(b"\xff\xd8"):
+            return jpeg(reader)
+        if reader.head.startswith(b"\x89PNG\r\n\x1a\n"):
+            return png(reader)
+        if reader.head[:4] in (b"II*\0", b"MM\0*"):
+            return tiff(reader)
+    except (ValueError, struct.error, zlib.error, IndexError):
+        pass
+    return {}
+
+def read(path):
+    with open(path, "rb") as f:
+        return read_file(f)
+
+def default_cache_file():
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(cache, "exif_header.sqlite")
+
+class Cache:
+    '''
+    The tags of files, kept in an sqlite database that all the photo scripts
+    share.  A file is only read again when its device, inode, size or
+    modification time change.  Without a database (filename None or one that
+    cannot be opened) the files are always read.
+    '''
+    def __init__(self, filename=None):
+        self.lock = threading.Lock()
+        self.db = None
+        if filename is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            self.db = sqlite3.connect(filename, timeout=60, check_same_thread=False, isolation_level=None)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=OFF") # it is only a cache
+            self.db.execute("CREATE TABLE IF NOT EXISTS tags (dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, tags TEXT, PRIMARY KEY (dev, ino))")
+        except (OSError, sqlite3.Error):
+            self.db = None
+
+    def tags(self, path):
+        '''the tags of path as a dict, from the database if it has not changed'''
+        st = os.stat(path)
+        if stat.S_ISDIR(st.st_mode):
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+        key = (st.st_dev, st.st_ino)
+        if self.db is not None:
+            with self.lock:
+                row = self.db.execute("SELECT size, mtime_ns, tags FROM tags WHERE dev = ? AND ino = ?", key).fetchone()
+            if row and row[:2] == (st.st_size, st.st_mtime_ns):
+                return json.loads(row[2])
+        result = read(path)
+        if self.db is not None:
+            try:
+                with self.lock:
+                    self.db.execute("INSERT OR REPLACE INTO tags VALUES (?, ?, ?, ?, ?)", key + (st.st_size, st.st_mtime_ns, json.dumps(result)))
+            except sqlite3.Error:
+                pass
+        return result
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+shared = None
+shared_pid = None
+shared_lock = threading.Lock()
+
+def tags(path):
+    '''the tags of path using the cache in $XDG_CACHE_HOME, or $EXIF_HEADER_CACHE if set ("" for none)'''
+    global shared, shared_pid
+    with shared_lock:
+        if shared is None or shared_pid != os.getpid(): # not a connection inherited from a fork
+            shared_pid = os.getpid()
+            shared = Cache(os.environ.get("EXIF_HEADER_CACHE", default_cache_file()) or None)
+    return shared.tags(path)
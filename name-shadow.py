@@ -17,18 +17,22 @@ import sys
 import shlex
 import logging
 import re
+import concurrent.futures
+import shadow_state
 
 def empty_if_none(s):
     if s:
         return s
     return ''
 
+NAME = re.compile(r"^(?P<fn>[^ ]+)(?:(?P<space> )(?P<text>[^:]+))?(?: \(\d\d\d\d[:-]\d\d[:-]\d\d( \d\d:\d\d)?\))?(?P<suffix>\.[a-z0-9][a-z0-9][a-z0-9])$")
+
 def transform_name(fn):
     fname,  suffix = os.path.splitext(fn)
     if not suffix:
         return None
 
-    m = re.match(r"^(?P<fn>[^ ]+)(?:(?P<space> )(?P<text>[^:]+))?(?: \(\d\d\d\d[:-]\d\d[:-]\d\d( \d\d:\d\d)?\))?(?P<suffix>\.[a-z0-9][a-z0-9][a-z0-9])$", fn)
+    m = NAME.match(fn)
 
     if not m:
         logging.fatal("match failed on: %s", fn)
@@ -38,38 +42,44 @@ def transform_name(fn):
     logging.debug("%s mapped to %s", fn, name)
     return name
 
-def check_and_update(src, dst_dir,  new_name):
-    dst = os.path.join(dst_dir,  new_name)
+def inodes(directory):
+    '''name -> inode of the entries in directory, without a stat for each'''
+    with os.scandir(directory) as it:
+        return { entry.name: entry.inode() for entry in it }
+
+def check_and_update(src, dst, same):
+    if same:
+        return
     try:
-        if os.path.samefile(src,  dst):
-            return
+        os.unlink(dst)
     except FileNotFoundError:
-            pass
+        pass
     else:
         logging.info("rm %s", shlex.quote(dst))
-        os.unlink(dst)
     logging.info("ln %s %s",  shlex.quote(src),  shlex.quote(dst))
     os.link(src,  dst)
-    
-def rm_extra(dst_dir,  wanted):
-    for fn in frozenset(os.listdir(dst_dir)) -  wanted:
+
+def rm_extra(dst_dir, existing, wanted):
+    for fn in frozenset(existing) - wanted:
         fname = os.path.join(dst_dir,  fn)
         logging.debug("rm %s",  shlex.quote(fname))
         os.unlink(fname)
 
-def check_and_update_directory(src_dir, dst_dir):
+def check_and_update_directory(src_dir, dst_dir, existing):
     wanted = set()
-    for fn in os.listdir(src_dir):
+    for fn, inode in inodes(src_dir).items():
         new_name =  transform_name(fn)
         if new_name:
-            check_and_update(os.path.join(src_dir,  fn),  dst_dir,  new_name)
+            # the source and the destination are on the same file system as they are hard links
+            check_and_update(os.path.join(src_dir,  fn), os.path.join(dst_dir, new_name), existing.get(new_name) == inode)
             wanted.add(new_name)
     return wanted
 
 def shadow_dir(src_dir, dst_dir):
-    wanted = check_and_update_directory(src_dir, dst_dir)
-    rm_extra(dst_dir,  wanted)
-    
+    existing = inodes(dst_dir)
+    wanted = check_and_update_directory(src_dir, dst_dir, existing)
+    rm_extra(dst_dir, existing, wanted)
+
 def delete_directory(dst):
     count = 0
     for f in os.listdir(dst):
@@ -88,17 +98,38 @@ def rmdir_extra(src_dirs,  dst_dirs,  dst_dir):
     for fn in dst_dirs - src_dirs:
         delete_directory(os.path.join(dst_dir, fn))
 
-def shadow(src_dir, dst_dir):
+def fingerprint(directory):
+    st = os.stat(directory)
+    return [st.st_mtime_ns, st.st_ctime_ns]
+
+def shadow_album(src, dst, previous):
+    '''
+    An album whose source and destination directories have not changed since
+    the previous run is not listed.  Returns the new fingerprint of both.
+    '''
+    before = fingerprint(src)
+    if previous == before + fingerprint(dst):
+        logging.debug("unchanged %s",  shlex.quote(src))
+        return previous
+    shadow_dir(src, dst)
+    return before + fingerprint(dst)
+
+def shadow(src_dir, dst_dir, options):
     logging.debug("shadow %s %s",  shlex.quote(src_dir),  shlex.quote(dst_dir))
     src_dirs = frozenset(os.listdir(src_dir))
     dst_dirs = frozenset(os.listdir(dst_dir))
     
     mkdir_missing(src_dirs,  dst_dirs,  dst_dir)  
 
-    for fn in src_dirs:
-         shadow_dir(os.path.join(src_dir, fn), os.path.join(dst_dir, fn))
+    fn_state = shadow_state.state_file("name-shadow", src_dir, dst_dir)
+    state = {} if options.rescan else shadow_state.read_state(fn_state)
+    with concurrent.futures.ThreadPoolExecutor(options.threads) as executor:
+        albums = sorted(src_dirs)
+        fingerprints = executor.map(lambda fn: shadow_album(os.path.join(src_dir, fn), os.path.join(dst_dir, fn), state.get(fn)), albums)
+        new_state = dict(zip(albums, fingerprints))
 
     rmdir_extra(src_dirs,  dst_dirs,  dst_dir)     
+    shadow_state.write_state(fn_state, new_state)
  
 def main():
     parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter,
@@ -108,6 +139,9 @@ def main():
     parser.add_argument("-i", "--info", dest='loglevel', action="store_const", const='info', help="info loglevel")
     parser.add_argument("-l", "--loglevel", metavar="LEVEL", help="set logging level")
 
+    parser.add_argument("--threads", type=int, default=4, help="update this many albums at once")
+    parser.add_argument("--rescan", action="store_true", help="update every album even if it has not changed since the previous run")
+
     parser.add_argument('source', help='directory to shadow')
     parser.add_argument('destination', help='destination directory')
 
@@ -116,7 +150,7 @@ def main():
     if not isinstance(numeric_level, int):
         sys.exit('Invalid log level: %s' % options.loglevel)
     logging.basicConfig(level=numeric_level)
-    shadow(options.source, options.destination)
+    shadow(options.source, options.destination, options)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,175 @@
+# reflink Copyright (c) 2026 Stuart Pook (http://www.pook.it/)
+# Copy files like cp --reflink without running cp
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import errno
+import fcntl
+import shutil
+import stat
+import threading
+import concurrent.futures
+
+FICLONE = 0x40049409 # _IOW(0x94, 9, int) from linux/fs.h
+
+# the file system cannot share the blocks of these two files
+UNSUPPORTED = frozenset([errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS])
+
+def copy_range(fsrc, fdst):
+    while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1 << 30):
+        pass
+
+def copy_contents(fsrc, fdst, reflink):
+    '''how the contents of fsrc were put in the empty fdst: "clone", "copy_file_range" or "copy"'''
+    if reflink not in ("always", "auto", "never"):
+        raise ValueError("reflink must be always, auto or never, not %s" % reflink)
+    if reflink != "never":
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return "clone"
+        except OSError as ex:
+            if reflink == "always" or ex.errno not in UNSUPPORTED:
+                raise
+    try:
+        copy_range(fsrc, fdst)
+        return "copy_file_range"
+    except OSError as ex:
+        if ex.errno not in UNSUPPORTED:
+            raise
+    fsrc.seek(0)
+    fdst.seek(0)
+    fdst.truncate()
+    shutil.copyfileobj(fsrc, fdst, 1 << 20)
+    return "copy"
+
+def clone(src, dst, reflink="auto", clobber=True, preserve_mode=False):
+    '''
+    Copy src to dst as cp --reflink=reflink would: share the blocks of src if
+    reflink is always or auto and the file system can, otherwise copy them.
+    dst is replaced unless clobber is False, in which case an existing dst is
+    left alone and False is returned.  The mode of dst is that of src if
+    preserve_mode, like cp, otherwise the default, like cp --no-preserve=mode.
+    A dst that is not a regular file, such as a symlink, is removed rather
+    than written through and, like cp, a dst that is src is refused.
+    '''
+    with open(src, "rb") as fsrc:
+        st = os.fstat(fsrc.fileno())
+        mode = stat.S_IMODE(st.st_mode) if preserve_mode else 0o666
+        if clobber:
+            try:
+                dst_stat = os.lstat(dst)
+            except FileNotFoundError:
+                pass
+            else:
+                if not stat.S_ISREG(dst_stat.st_mode):
+                    os.unlink(dst)
+                elif (dst_stat.st_dev, dst_stat.st_ino) == (st.st_dev, st.st_ino):
+                    raise shutil.SameFileError("%s and %s are the same file" % (src, dst))
+        flags = os.O_WRONLY | os.O_CREAT | os.O_NOFOLLOW | (os.O_TRUNC if clobber else os.O_EXCL)
+        try:
+            fd = os.open(dst, flags, mode)
+        except FileExistsError:
+            if clobber:
+                raise
+            return False
+        with open(fd, "wb") as fdst:
+            try:
+                copy_contents(fsrc, fdst, reflink)
+            except BaseException:
+                os.unlink(dst)
+                raise
+    return True
+
+class Cloner:
+    '''
+    Run clones, or any other function, in a pool of threads.  submit() blocks
+    when too many are waiting and wait() raises the first exception of the
+    functions submitted since the previous wait().
+    '''
+    def __init__(self, threads=4):
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.slots = threading.BoundedSemaphore(threads * 4)
+        self.done = threading.Condition()
+        self.outstanding = 0
+        self.error = None
+
+    def run(self, function, args, kwargs):
+        try:
+            function(*args, **kwargs)
+        except BaseException as ex:
+            with self.done:
+                if self.error is None:
+                    self.error = ex
+        finally:
+            with self.done:
+                self.outstanding -= 1
+                self.done.notify_all()
+            self.slots.release()
+
+    def submit(self, function, *args, **kwargs):
+        self.slots.acquire()
+        with self.done:
+            self.outstanding += 1
+        self.executor.submit(self.run, function, args, kwargs)
+
+    def clone(self, src, dst, reflink="auto", clobber=True, preserve_mode=False):
+        self.submit(clone, src, dst, reflink=reflink, clobber=clobber, preserve_mode=preserve_mode)
+
+    def wait(self):
+        with self.done:
+            while self.outstanding:
+                self.done.wait()
+            error = self.error
+            self.error = None
+        if error is not None:
+            raise error
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def self_test():
+    '''clone over a dst that is a symlink to src, a hard link to src and src itself'''
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src")
+        dst = os.path.join(tmp, "dst")
+        with open(src, "w") as f:
+            f.write("contents\n")
+        os.symlink(src, dst)
+        clone(src, dst)
+        assert not os.path.islink(dst), "symlink dst was not replaced"
+        for path in (src, dst):
+            with open(path) as f:
+                assert f.read() == "contents\n", "%s was changed" % path
+        os.unlink(dst)
+        os.link(src, dst)
+        for d in (dst, src):
+            try:
+                clone(src, d)
+                raise AssertionError("clone to %s did not fail" % d)
+            except shutil.SameFileError:
+                pass
+        with open(src) as f:
+            assert f.read() == "contents\n", "src was truncated"
+    print("reflink: ok")
+
+if __name__ == "__main__":
+    self_test()
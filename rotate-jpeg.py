@@ -17,40 +17,52 @@
 from __future__ import print_function
 
 import os
-import subprocess
+import shutil
 import sys
+import reflink
+import exif_header
+import string
+import optparse
+import collections
+import hashlib
+import io
+import math
+import struct
+import time
+import json
+import copy
+import socket
+import socketserver
+import multiprocessing
+import signal
 
 def import_failed(pkg):
 	print(f"import failed, do: sudo apt-get install {pkg}", file=sys.stderr)
 	sys.exit(87)
 
-try:
-    from PIL import Image
-except ImportError:
-	import_failed("python3-pil")
-import string
-import optparse
-import collections
-try:
-    import piexif
-except ImportError:
-    import_failed("python3-piexif")
-try:
-    import cv2
-except ImportError:
-    import_failed("python3-opencv")
-try:
-    import lensfun
-except ImportError:
-    import_failed("python3-lensfun")
-
-import gi.repository
-gi.require_version('GExiv2', '0.10')
-try:
-	from gi.repository import GExiv2
-except ImportError:
-    print("sudo apt-get install gir1.2-gexiv2-0.10 python3-gi", file=sys.stderr)
-    raise
+def import_libraries():
+	'''the image libraries take much longer to import than a photo takes to convert, only import them when they are needed'''
+	global Image, numpy, piexif, cv2, lensfun
+	try:
+	    from PIL import Image
+	except ImportError:
+		import_failed("python3-pil")
+	try:
+	    import numpy
+	except ImportError:
+	    import_failed("python3-numpy")
+	try:
+	    import piexif
+	except ImportError:
+	    import_failed("python3-piexif")
+	try:
+	    import cv2
+	except ImportError:
+	    import_failed("python3-opencv")
+	try:
+	    import lensfun
+	except ImportError:
+	    import_failed("python3-lensfun")
 
 def error(*message):
 	print(*message, file=sys.stderr)
@@ -60,29 +72,96 @@ def verbose(options, *message):
 	if options.verbose:
 		print(*message, file=sys.stderr)
 
-def update_size(dest, image):
-	# http://stackoverflow.com/questions/400788/resize-image-in-python-without-losing-exif-data
-	dest.set_metadata_pixel_width(image.size[0])
-	dest.set_metadata_pixel_height(image.size[1])
+def exif_bytes(inputfile, size, options):
+	'''the EXIF block of inputfile for a copy that is size pixels, b"" when piexif cannot rewrite it'''
+	try:
+		exif = piexif.load(inputfile)
+		exif["Exif"][piexif.ExifIFD.PixelXDimension] = size[0]
+		exif["Exif"][piexif.ExifIFD.PixelYDimension] = size[1]
+		return piexif.dump(exif)
+	except (ValueError, TypeError, struct.error, piexif.InvalidImageDataError) as ex: # old img* files
+		verbose(options, "not copying exif data of", inputfile, ex)
+		return b""
 
-def read_exif_data(image, source_path, options):
-	source = GExiv2.Metadata(source_path)
-	return source
+def write_output(data, options):
+	with open(options.output, "wb") as f:
+		f.write(data)
 
-def copy_exif_data(image, source_path, dest_path, options):
-	source = read_exif_data(image, source_path, options)
-	dest = GExiv2.Metadata(dest_path)
-	for tag in source.get_exif_tags():
-		try:
-			dest[tag] = source[tag]
-		except UnicodeDecodeError:
-			pass
-	update_size(dest, image)
-	try:
-		dest.save_file(dest_path)
-	except gi.repository.GLib.Error:
-		dest.clear_exif() # old img* files
-		dest.save_file(dest_path)
+# rough bits per pixel of libjpeg at some qualities for photographs
+JPEG_BPP = ((10, 0.35), (20, 0.55), (30, 0.7), (50, 0.95), (75, 1.45), (85, 1.9), (90, 2.4), (95, 3.4), (100, 7.0))
+
+# the luminance quantization table of the JPEG standard that libjpeg scales by the quality
+STANDARD_LUMINANCE = (16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+	14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+	18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+	49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99)
+
+def jpeg_bpp(quality):
+	for (q0, b0), (q1, b1) in zip(JPEG_BPP, JPEG_BPP[1:]):
+		if quality <= q1:
+			return b0 + (b1 - b0) * (max(quality, q0) - q0) / (q1 - q0)
+	return JPEG_BPP[-1][1]
+
+def jpeg_quality(im):
+	'''the libjpeg quality whose luminance table is closest to that of the JPEG im, None if im is not a JPEG'''
+	tables = getattr(im, "quantization", None)
+	if not tables or 0 not in tables:
+		return None
+	total = sum(tables[0])
+	def scaled(q):
+		scale = 5000 // q if q < 50 else 200 - 2 * q
+		return sum(min(max((v * scale + 50) // 100, 1), 255) for v in STANDARD_LUMINANCE)
+	return min(range(1, 101), key=lambda q: abs(scaled(q) - total))
+
+def predicted_size(im, inputfile, size, options):
+	'''a guess at the bytes in the JPEG of inputfile (opened as im) resized to size, None if there is no basis for one'''
+	quality = jpeg_quality(im)
+	if quality is None:
+		return None
+	pixels = size[0] * size[1] / (im.size[0] * im.size[1])
+	return os.path.getsize(inputfile) * pixels * jpeg_bpp(options.quality) / jpeg_bpp(quality)
+
+def psnr(a, b):
+	'''peak signal to noise ratio in dB of two 8 bit images, cropped to the same size'''
+	h = min(a.shape[0], b.shape[0])
+	w = min(a.shape[1], b.shape[1])
+	mse = numpy.mean((a[:h, :w].astype(numpy.float64) - b[:h, :w].astype(numpy.float64)) ** 2)
+	return math.inf if mse == 0 else 10 * math.log10(255 ** 2 / mse)
+
+def cv2_jpeg(im, quality):
+	ok, data = cv2.imencode(".jpg", im, (cv2.IMWRITE_JPEG_QUALITY, quality))
+	return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
+def psnr_loss(full, reduced, to_array, saved):
+	'''how many dB closer to full its JPEG is than the JPEG of reduced'''
+	reference = to_array(full)
+	return psnr(reference, saved(full)) - psnr(reference, saved(reduced))
+
+def pil_shrink(inputfile, width, height):
+	'''
+	inputfile resized to fit in width x height, thumbnail() already has
+	libjpeg decode it at a reduced scale at least twice as large as that
+	'''
+	im = Image.open(inputfile)
+	im.thumbnail((width, height), Image.Resampling.LANCZOS)
+	return im.convert('RGB')
+
+def reduced_flag(inputfile, width, height):
+	'''the cv2.imread flag that decodes inputfile at the smallest scale still larger than width x height'''
+	if width and height:
+		size = Image.open(inputfile).size
+		for scale, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+			if min(size) // scale >= min(width, height) and max(size) // scale >= max(width, height):
+				return flag
+	return cv2.IMREAD_COLOR
+
+def copy_input(inputfile, options):
+	if options.reflink:
+		reflink.clone(inputfile, options.output, options.reflink, preserve_mode=True)
+	elif options.no_dimensions_symlink:
+		shutil.copyfile(inputfile, options.output)
+	else:
+		os.symlink(inputfile, options.output)
 
 def shrink(inputfile, options):
 	verbose(options, "shrink", inputfile)
@@ -94,43 +173,39 @@ def shrink(inputfile, options):
 	if ih and iw and ih > iw:
 		width, height = height, width
 	if not (width and height) or iw <= width * options.size_margin and ih <= height * options.size_margin:
-		if options.reflink:
-			subprocess.check_call(["cp", "--reflink=" + options.reflink, inputfile, options.output])
-		else:
-			if options.no_dimensions_symlink:
-				shutil.copyfile(inputfile, options.output)
-			else:
-				os.symlink(inputfile, options.output)
+		copy_input(inputfile, options)
 	else:
-		im.thumbnail((width, height), Image.Resampling.LANCZOS)
-		im = im.convert('RGB')
-		im.save(options.output, "JPEG", quality=options.quality)
-		copy_exif_data(im, inputfile, options.output, options)
-		if os.path.getsize(options.output) > os.path.getsize(inputfile) * 1.2:
-			os.remove(options.output)
-			if options.reflink:
-				subprocess.check_call(["cp", "--reflink=" + options.reflink, inputfile, options.output])
-			else:
-				os.symlink(inputfile, options.output)
+		limit = os.path.getsize(inputfile) * 1.2
+		predicted = predicted_size(im, inputfile, get_size(iw, ih, width, height) or im.size, options)
+		verbose(options, "predicted size", predicted)
+		if predicted is not None and predicted > limit * options.size_prediction_margin:
+			verbose(options, "output would be larger than", inputfile)
+			return copy_input(inputfile, options)
+		im = pil_shrink(inputfile, width, height)
+		f = io.BytesIO()
+		im.save(f, "JPEG", quality=options.quality, exif=exif_bytes(inputfile, im.size, options))
+		if f.tell() > limit:
+			verbose(options, "output larger than", inputfile)
+			return copy_input(inputfile, options)
+		write_output(f.getbuffer(), options)
 
 def get_required_exif_data(options, exif):
-	# https://git.gnome.org/browse/gexiv2/tree/GExiv2.py
-	cam_maker = exif.get('Exif.Image.Make')
+	cam_maker = exif.get('Image Make')
 	if cam_maker is None:
 		return None
-	camera_model = exif.get('Exif.Image.Model')
+	camera_model = exif.get('Image Model')
 	if camera_model is None:
 		return None
 
-	focallength = exif.get_exif_tag_rational('Exif.Photo.FocalLength')
+	focallength = exif.get('EXIF FocalLength')
 	if focallength is None:
 		return None
 
-	aperture = exif.get_exif_tag_rational('Exif.Photo.ApertureValue')
+	aperture = exif.get('EXIF ApertureValue')
 	if aperture is None:
 		return None
 
-	distance = exif.get_exif_tag_rational('Exif.Photo.SubjectDistance')
+	distance = exif.get('EXIF SubjectDistance')
 	if distance is None:
 		return None
 
@@ -153,8 +228,87 @@ def get_size(iw, ih, width, height):
 		return (int(iw * rh), height)
 	return (width, int(ih * rw))
 
+def evict_maps(directory, options):
+	maps = []
+	for fn in os.listdir(directory):
+		if fn.endswith(".npy"):
+			try:
+				st = os.stat(os.path.join(directory, fn))
+			except FileNotFoundError:
+				continue
+			maps.append((st.st_mtime, st.st_size, fn))
+	total = sum(size for mtime, size, fn in maps)
+	for mtime, size, fn in sorted(maps):
+		if total <= options.map_cache_size << 20:
+			break
+		verbose(options, "evict", fn)
+		try:
+			os.remove(os.path.join(directory, fn))
+		except FileNotFoundError:
+			pass
+		total -= size
+
+def undistortion_map(lens, cam, iw, ih, required_info, options):
+	'''
+	The coordinates that undistort a photo, which only depend on these
+	parameters.  They are kept as .npy files in options.map_cache and mapped
+	from there, the least recently used are removed when the files take more
+	than options.map_cache_size megabytes.
+	'''
+	def compute():
+		mod = lensfun.Modifier(lens, cam.crop_factor, iw, ih)
+		mod.initialize(required_info.focal_length, required_info.aperture, required_info.subject_distance)
+		return mod.apply_geometry_distortion()
+	if not options.map_cache:
+		return compute()
+	directory = os.path.expanduser(options.map_cache)
+	parameters = (cam.maker, cam.model, lens.maker, lens.model, cam.crop_factor, iw, ih, float(required_info.focal_length), float(required_info.aperture), float(required_info.subject_distance))
+	fn = os.path.join(directory, hashlib.sha1(repr(parameters).encode()).hexdigest() + ".npy")
+	try:
+		coords = numpy.load(fn, mmap_mode='r')
+		os.utime(fn)
+		verbose(options, "using undistortion map", fn)
+		return coords
+	except (FileNotFoundError, ValueError):
+		pass
+	coords = compute()
+	os.makedirs(directory, exist_ok=True)
+	tmp = "%s.%d.tmp" % (fn, os.getpid())
+	try:
+		with open(tmp, "wb") as f:
+			numpy.save(f, coords)
+		os.rename(tmp, fn)
+	except OSError as ex:
+		verbose(options, "cannot cache undistortion map", fn, ex)
+		try:
+			os.remove(tmp)
+		except FileNotFoundError:
+			pass
+	else:
+		evict_maps(directory, options)
+	return coords
+
+def undistort_image(im, lens, cam, required_info, width, height, full_size, options):
+	'''im undistorted and resized to fit in width x height, full_size is the size of the photo before any reduced decoding'''
+	ih, iw = im.shape[0], im.shape[1]
+	undistCoords = undistortion_map(lens, cam, iw, ih, required_info, options)
+	imUndistorted = cv2.remap(im, undistCoords, None, cv2.INTER_NEAREST)
+	#http://docs.opencv.org/2.4/modules/imgproc/doc/geometric_transformations.html
+	sz = get_size(iw, ih, width, height)
+	if sz:
+		shrunk = cv2.resize(imUndistorted, sz, interpolation=cv2.INTER_AREA)
+		verbose(options, "ratio is (%d %d) != (%d %d)" % (shrunk.shape[1], shrunk.shape[0], iw, ih))
+		if shrunk.shape[0] != height and shrunk.shape[1] != height and shrunk.shape[0] != width and  shrunk.shape[1] != width:
+			error("new size is wrong (%d %d) != (%d %d)" % (shrunk.shape[1], shrunk.shape[0], iw, ih))
+		if abs(shrunk.shape[0] / float(shrunk.shape[1]) - full_size[1] / float(full_size[0])) > options.ratio_change:
+			error("ratio changed (%d %d) != (%d %d)" % (shrunk.shape[1], shrunk.shape[0], full_size[0], full_size[1]))
+	else:
+		shrunk = imUndistorted
+		verbose(options, "using imUndistorted")
+	return shrunk
+
 def undistort(inputfile, options):
-	exif = GExiv2.Metadata(inputfile)
+	exif = exif_header.tags(inputfile)
 	required_info = get_required_exif_data(options, exif)
 	if required_info is None:
 		return shrink(inputfile, options)
@@ -163,8 +317,12 @@ def undistort(inputfile, options):
 	cam = db.find_cameras(required_info.camera_maker, required_info.camera_model)[0]
 	lens = db.find_lenses(cam)[0]
 
-	im = cv2.imread(inputfile)
+	flag = cv2.IMREAD_COLOR if options.full_decode else reduced_flag(inputfile, options.width, options.height)
+	im = cv2.imread(inputfile, flag)
 	ih, iw = im.shape[0], im.shape[1]
+	full_size = Image.open(inputfile).size
+	if (ih > iw) != (full_size[1] > full_size[0]):
+		full_size = full_size[::-1] # cv2 has applied the EXIF orientation
 
 	owidth = options.width
 	oheight = options.height
@@ -174,48 +332,204 @@ def undistort(inputfile, options):
 	width = owidth if owidth else iw
 	height = oheight if oheight else ih
 
-	mod = lensfun.Modifier(lens, cam.crop_factor, iw, ih)
-	mod.initialize(required_info.focal_length, required_info.aperture, required_info.subject_distance)
-
-	undistCoords = mod.apply_geometry_distortion()
-	imUndistorted = cv2.remap(im, undistCoords, None, cv2.INTER_NEAREST)
-	#http://docs.opencv.org/2.4/modules/imgproc/doc/geometric_transformations.html
-	sz = get_size(iw, ih, width, height)
-	if sz:
-		shrunk = cv2.resize(imUndistorted, sz, interpolation=cv2.INTER_AREA)
-		verbose(options, "ratio is (%d %d) != (%d %d)" % (shrunk.shape[1], shrunk.shape[0], iw, ih))
-		if shrunk.shape[0] != height and shrunk.shape[1] != height and shrunk.shape[0] != width and  shrunk.shape[1] != width:
-			error("new size is wrong (%d %d) != (%d %d)" % (shrunk.shape[1], shrunk.shape[0], iw, ih))
-		if abs(shrunk.shape[0] / float(shrunk.shape[1]) - im.shape[0] / float(im.shape[1])) > options.ratio_change:
-			error("ratio changed (%d %d) != (%d %d)" % (shrunk.shape[1], shrunk.shape[0], im.shape[1], im.shape[0]))
-	else:
-		shrunk = imUndistorted
-		verbose(options, "using imUndistorted")
-	cv2.imwrite(options.output, shrunk, (cv2.IMWRITE_JPEG_QUALITY, options.quality))
+	shrunk = undistort_image(im, lens, cam, required_info, width, height, full_size, options)
+	if options.max_psnr_loss is not None and flag != cv2.IMREAD_COLOR:
+		full = undistort_image(cv2.imread(inputfile), lens, cam, required_info, width, height, full_size, options)
+		loss = psnr_loss(full, shrunk, lambda i: i, lambda i: cv2_jpeg(i, options.quality))
+		verbose(options, "reduced decoding loses %.2f dB" % loss)
+		if loss > options.max_psnr_loss:
+			shrunk = full
+	ok, data = cv2.imencode(".jpg", shrunk, (cv2.IMWRITE_JPEG_QUALITY, options.quality))
+	if not ok:
+		error("cannot encode", inputfile)
+	data = data.tobytes()
+	exif = exif_bytes(inputfile, (shrunk.shape[1], shrunk.shape[0]), options)
+	if exif:
+		f = io.BytesIO()
+		piexif.insert(exif, data, f)
+		data = f.getbuffer()
+	write_output(data, options)
 
-	exif['Exif.Photo.PixelXDimension'] = str(width)
-	exif['Exif.Photo.PixelYDimension'] = str(height)
-	exif.save_file(options.output)
+def benchmark(inputfile, options):
+	'''time the OpenCV resize of inputfile with and without reduced decoding and compare the quality of the results'''
+	size = Image.open(inputfile).size
+	width = options.width or size[0]
+	height = options.height or size[1]
+	if size[1] > size[0]:
+		width, height = height, width
+	def cv2_shrink(flag):
+		im = cv2.imread(inputfile, flag)
+		sz = get_size(im.shape[1], im.shape[0], width, height)
+		return cv2.resize(im, sz, interpolation=cv2.INTER_AREA) if sz else im
+	results = []
+	for flag in (cv2.IMREAD_COLOR, reduced_flag(inputfile, width, height)):
+		start = time.monotonic()
+		for i in range(options.benchmark):
+			im = cv2_shrink(flag)
+		results.append((options.benchmark / (time.monotonic() - start), im))
+	(full_rate, full), (reduced_rate, reduced) = results
+	saved = lambda i: cv2_jpeg(i, options.quality)
+	print("opencv: full %.2f images/s %.2f dB, reduced %.2f images/s %.2f dB, loss %.2f dB" % (full_rate,
+		psnr(full, saved(full)), reduced_rate, psnr(full, saved(reduced)), psnr_loss(full, reduced, lambda i: i, saved)))
 
-def main():
+def make_parser():
 	parser = optparse.OptionParser(usage="usage: %prog [--help] [options] inputfile")
 	parser.add_option("-o", "--output", help="output file name [%default]")
 	parser.add_option("-v", "--verbose", action="store_true", help="verbose")
 	parser.add_option("--resizing_pp3", metavar="DUMMY", help="ignored [%default]")
 	parser.add_option("-R", "--reflink", default="always", help="cp reflink option [%default]")
 	parser.add_option("--no_dimensions_symlink", action="store_true", help="don't make any symlinks even if the dimensions seem ok")
+	parser.add_option("--size_prediction_margin", type='float', default=1.5, metavar="FACTOR", help="copy the input without encoding when the output is predicted to be FACTOR times larger than the 1.2 x input limit [%default]")
 	parser.add_option("-m", "--size_margin", type='float', default=1.1, help="margin for files almost the same size [%default]")
 	parser.add_option("--ratio_change", type='float', default=0.002, help="maximum accepted ratio change after resize [%default]")
 	parser.add_option("-w", "--width", type='int', default=None, help="output width [%default]")
 	parser.add_option("--height", type='int', default=None, help="output height [%default]")
 	parser.add_option("-q", "--quality", type='int', default=20, help="output JPEG quality [%default]")
+	parser.add_option("--full_decode", action="store_true", help="when undistorting, decode the whole image rather than letting libjpeg decode a reduced version just larger than the output (a plain resize already decodes at a reduced scale)")
+	parser.add_option("--max_psnr_loss", type='float', default=None, metavar="DB", help="when undistorting, also resize the fully decoded image and use it if the JPEG from the reduced decoding is more than DB worse (PSNR against the full resize) [%default]")
+	parser.add_option("--benchmark", type='int', default=0, metavar="N", help="resize the input N times with OpenCV with and without reduced decoding and print the speed and PSNR")
+	parser.add_option("--map_cache", default=os.path.join(os.environ.get("XDG_CACHE_HOME", "~/.cache"), "rotate-jpeg"), metavar="DIRECTORY", help="keep the undistortion maps in DIRECTORY, empty to disable [%default]")
+	parser.add_option("--map_cache_size", type='int', default=2048, metavar="MEGABYTES", help="maximum size of the undistortion maps kept [%default]")
+	parser.add_option("--batch", metavar="FILE", help="convert the jobs in FILE, JSON lines {\"output\": ..., \"inputs\": [...]} as written by transform2, - for stdin")
+	parser.add_option("--serve", metavar="SOCKET", help="convert the photos sent by rotate-jpeg --server to the Unix socket SOCKET")
+	parser.add_option("--server", default=os.environ.get("ROTATE_JPEG_SERVER"), metavar="SOCKET", help="have the rotate-jpeg --serve listening on SOCKET do the conversion, do it here if it does not answer [$ROTATE_JPEG_SERVER]")
+	parser.add_option("--processes", type='int', default=None, help="number of processes for --batch (1 by default) and --serve (the number of cpus by default)")
+	return parser
+
+def convert(job):
+	'''
+	convert one (inputfile, options) job in a worker process, returns None or
+	the error, a job that fails leaves no output so that transform2 runs it
+	again on its own
+	'''
+	inputfile, options = job
+	try:
+		undistort(inputfile, options)
+		return None
+	except SystemExit as ex:
+		error = "failed (%s)" % ex.code
+	except Exception as ex:
+		error = "%s: %s" % (type(ex).__name__, ex)
+	try:
+		os.remove(options.output)
+	except FileNotFoundError:
+		pass
+	return error
+
+def make_pool(options, default):
+	'''
+	the libraries are imported here first so that a missing one stops us,
+	an initializer that exits would have the pool start new workers forever
+	'''
+	import_libraries()
+	return multiprocessing.Pool(options.processes or default, initializer=import_libraries)
+
+def run_batch(options):
+	'''convert the jobs in options.batch in a pool of processes that only import the libraries once'''
+	with (sys.stdin if options.batch == "-" else open(options.batch)) as f:
+		jobs = []
+		for line in f:
+			if line.strip():
+				request = json.loads(line)
+				job = copy.copy(options)
+				job.batch = None
+				job.output = request["output"]
+				jobs.append((request["inputs"][0], job))
+	status = 0
+	with make_pool(options, 1) as pool:
+		for (inputfile, job), failure in zip(jobs, pool.imap(convert, jobs)):
+			if failure:
+				print(job.output + ":", failure, file=sys.stderr)
+				status = 1
+			else:
+				verbose(options, "converted", inputfile, job.output)
+	return status
+
+class JobHandler(socketserver.StreamRequestHandler):
+	'''
+	Each request is a JSON line {"argv": [...], "cwd": ...} with the command
+	line arguments of rotate-jpeg, the reply is a JSON line {"output": ...,
+	"status": 0 or 1, "error": ...}.
+	'''
+	def handle(self):
+		for line in self.rfile:
+			request = json.loads(line)
+			reply = { "output": None, "status": 1, "error": None }
+			try:
+				options, args = make_parser().parse_args(request["argv"])
+			except SystemExit:
+				reply["error"] = "bad arguments %s" % request["argv"]
+			else:
+				if len(args) != 1 or not options.output:
+					reply["error"] = "need an input file and --output"
+				else:
+					options.output = os.path.join(request["cwd"], options.output)
+					reply["output"] = options.output
+					reply["error"] = self.server.pool.apply(convert, ((os.path.join(request["cwd"], args[0]), options),))
+					reply["status"] = 1 if reply["error"] else 0
+			self.wfile.write((json.dumps(reply) + "\n").encode())
+			self.wfile.flush()
+
+class JobServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	daemon_threads = True
+
+def serve(options):
+	try:
+		os.unlink(options.serve)
+	except FileNotFoundError:
+		pass
+	server = JobServer(options.serve, JobHandler)
+	server.pool = make_pool(options, os.cpu_count())
+	verbose(options, "serving on", options.serve)
+	signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+	try:
+		server.serve_forever()
+	finally:
+		server.pool.terminate()
+		os.unlink(options.serve)
+
+def send_to_server(argv, options):
+	'''have the rotate-jpeg --serve on options.server convert, returns the status or None if the server did not answer'''
+	with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+		try:
+			sock.connect(options.server)
+			f = sock.makefile("rwb")
+			f.write((json.dumps({ "argv": argv, "cwd": os.getcwd() }) + "\n").encode())
+			f.flush()
+			line = f.readline()
+		except OSError as ex:
+			verbose(options, "server", options.server, "not available:", ex)
+			return None
+	if not line:
+		verbose(options, "server", options.server, "did not answer")
+		return None
+	reply = json.loads(line)
+	if reply["error"]:
+		print(str(reply["output"]) + ":", reply["error"], file=sys.stderr)
+	return reply["status"]
+
+def main():
+	parser = make_parser()
 	(options, args) = parser.parse_args()
+	if options.serve:
+		return serve(options)
+	if options.batch:
+		return run_batch(options)
 	if len(args) != 1:
 		parser.error("must supply 1 argument (found %d %s)" % (len(args), args))
 	inputfile = args[0]
+	if options.benchmark:
+		import_libraries()
+		benchmark(inputfile, options)
+		return 0
 	if not options.output:
 		parser.error("--output option is compulsory")
-		
+	if options.server:
+		status = send_to_server(sys.argv[1:], options)
+		if status is not None:
+			return status
+
+	import_libraries()
 	undistort(inputfile, options)
 	return 0
 
@@ -0,0 +1,46 @@
+# shadow_state Copyright (c) 2026 Stuart Pook (http://www.pook.it/)
+# Remember which albums a shadowing script has already done
+#
+# This program is free software: you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation, either version 3 of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT ANY
+# WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import os
+import json
+import shlex
+import hashlib
+import logging
+
+def state_file(program, src_dir, dst_dir, *key):
+    '''where program keeps the state of the albums of src_dir shadowed in dst_dir, key is whatever else changes the shadows'''
+    cache = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    key = repr((os.path.abspath(src_dir), os.path.abspath(dst_dir)) + key)
+    return os.path.join(cache, program, hashlib.sha1(key.encode()).hexdigest() + ".json")
+
+def read_state(fn):
+    '''the state saved in fn, {} if there is none or it cannot be read'''
+    try:
+        with open(fn) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as ex:
+        logging.warning("ignoring %s: %s", shlex.quote(fn), ex)
+        return {}
+
+def write_state(fn, state):
+    '''save state in fn, a state that cannot be saved only means more work next time'''
+    tmp = fn + ".tmp"
+    try:
+        os.makedirs(os.path.dirname(fn), exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump(state, f)
+        os.rename(tmp, fn)
+    except OSError as ex:
+        logging.warning("cannot save state in %s: %s", shlex.quote(fn), ex)